@@ -1,37 +1,200 @@
 import sqlite3
+import os
+import sys
+import asyncio
 import json
 import random
 import time
 import threading
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response, Response
 from flask_restx import Api, Resource, fields, Namespace
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import signal
+from contextlib import contextmanager
+from functools import partial
+import numpy as np
+import orjson
+from cachetools import TLRUCache
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, every process runs its own updater
+    fcntl = None
+
+# Configure logging: threads only enqueue records, one listener thread writes them out
+log_handler = QueueHandler(queue.SimpleQueue())
+logging.basicConfig(level=logging.INFO, handlers=[log_handler])
+log_listener = None
+
+def start_log_listener():
+    """Start this process's log-writing thread on a fresh queue"""
+    global log_listener
+    log_handler.queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_handler.queue, logging.StreamHandler())
+    log_listener.start()
+
+start_log_listener()
+# Threads don't survive fork(), so a preloading server's workers each need a listener of their own
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=start_log_listener)
+atexit.register(lambda: log_listener.stop())
 logger = logging.getLogger(__name__)
 
+# True on free-threaded (3.13t+) interpreters, where worker threads run Python code in parallel
+FREE_THREADED = not getattr(sys, "_is_gil_enabled", lambda: True)()
+
+def uuid_to_blob(value):
+    """Convert a UUID string to its 16-byte storage form; None if it is not a UUID"""
+    try:
+        return uuid.UUID(value).bytes
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+def blob_to_uuid(value):
+    """Convert a stored 16-byte key back to its UUID string"""
+    return str(uuid.UUID(bytes=value))
+
+def dict_factory(cursor, row):
+    """Row factory producing plain dicts, ready to be returned from the API as-is"""
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+class ConnectionPool:
+    """Fixed set of read-only connections, handed out most recently used first"""
+    def __init__(self, connect, size=8):
+        # LIFO keeps the busiest few connections (and their page caches) hot
+        self._pool = queue.LifoQueue()
+        for _ in range(size):
+            conn = connect()
+            conn.execute("PRAGMA query_only=1")
+            conn.row_factory = dict_factory
+            self._pool.put(conn)
+    
+    def acquire(self):
+        return self._pool.get()
+    
+    def release(self, conn):
+        self._pool.put(conn)
+    
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
 class DatabaseManager:
+    CHECKPOINT_INTERVAL = 180  # seconds between WAL truncations
+    SCHEMA_VERSION = 1  # 1: UUID keys stored as 16-byte BLOBs
+    # UUID-valued columns per table, converted from TEXT when upgrading a version 0 file
+    UUID_COLUMNS = {
+        'users': ('id',),
+        'stocks': ('id',),
+        'stock_price_history': ('stock_id',),
+        'user_portfolios': ('user_id', 'stock_id'),
+        'transactions': ('id', 'user_id', 'stock_id'),
+        'loans': ('id', 'user_id'),
+    }
+    # Prepared statements are cached per connection, keyed by SQL text; keep every query resident
+    STATEMENT_CACHE_SIZE = 256
+    READ_POOL_SIZE = 8
+    BUSY_TIMEOUT = 10  # seconds to wait on another process's write lock before failing
+
     def __init__(self, db_path='trading_system.db'):
         self.db_path = db_path
+        self.checkpoint_thread = None
+        self._local = threading.local()
+        # SQLite handles must not cross fork(), so the pool is opened per process on first read
+        self.read_pool = None
+        self._read_pool_pid = None
+        self._read_pool_lock = threading.Lock()
         self.init_database()
+        atexit.register(self.close_connection)
+        atexit.register(self.close_read_pool)
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.BUSY_TIMEOUT,
+                               cached_statements=self.STATEMENT_CACHE_SIZE)
         conn.row_factory = sqlite3.Row
+        self._apply_pragmas(conn)
+        return conn
+    
+    def get_connection(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        # A forked child inherits the forking thread's locals; leave the parent's handle alone
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
         return conn
     
+    def reader(self):
+        """Borrow a read-only pooled connection: ``with db.reader() as conn: ...``"""
+        pid = os.getpid()
+        if self._read_pool_pid != pid:
+            with self._read_pool_lock:
+                if self._read_pool_pid != pid:
+                    self.read_pool = ConnectionPool(self._connect, self.READ_POOL_SIZE)
+                    self._read_pool_pid = pid
+        return self.read_pool.connection()
+    
+    def close_connection(self):
+        """Close this thread's connection, if one is open"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+            self._local.conn = None
+    
+    def close_read_pool(self):
+        """Close this process's read connections, if the pool was opened here"""
+        if self._read_pool_pid == os.getpid():
+            self.read_pool.close()
+    
+    def _apply_pragmas(self, conn):
+        """Per-connection tuning; WAL mode itself is persisted in the file"""
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MB
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+    
     def init_database(self):
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # auto_vacuum only applies to a fresh file, so set it before any table exists
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
+        # Take the write lock up front so concurrently starting processes queue behind one upgrade
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'")
+        upgrading = version < 1 and cursor.fetchone() is not None
+        if upgrading:
+            # Move the TEXT-keyed tables aside; their rows are copied into the new layout below
+            for table in self.UUID_COLUMNS:
+                cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_v0")
+        
         # Users table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
+                id BLOB PRIMARY KEY CHECK (length(id) = 16),
                 username TEXT UNIQUE NOT NULL,
                 balance REAL DEFAULT 10000.0,
                 loan_amount REAL DEFAULT 0.0,
@@ -43,7 +206,7 @@ class DatabaseManager:
         # Stocks table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS stocks (
-                id TEXT PRIMARY KEY,
+                id BLOB PRIMARY KEY CHECK (length(id) = 16),
                 symbol TEXT UNIQUE NOT NULL,
                 name TEXT NOT NULL,
                 current_price REAL NOT NULL,
@@ -56,7 +219,7 @@ class DatabaseManager:
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS stock_price_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                stock_id TEXT NOT NULL,
+                stock_id BLOB NOT NULL,
                 price REAL NOT NULL,
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (stock_id) REFERENCES stocks (id)
@@ -67,8 +230,8 @@ class DatabaseManager:
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS user_portfolios (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                stock_id TEXT NOT NULL,
+                user_id BLOB NOT NULL,
+                stock_id BLOB NOT NULL,
                 quantity INTEGER NOT NULL,
                 avg_buy_price REAL NOT NULL,
                 FOREIGN KEY (user_id) REFERENCES users (id),
@@ -80,9 +243,9 @@ class DatabaseManager:
         # Transactions
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS transactions (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                stock_id TEXT NOT NULL,
+                id BLOB PRIMARY KEY CHECK (length(id) = 16),
+                user_id BLOB NOT NULL,
+                stock_id BLOB NOT NULL,
                 transaction_type TEXT NOT NULL,
                 quantity INTEGER NOT NULL,
                 price REAL NOT NULL,
@@ -96,8 +259,8 @@ class DatabaseManager:
         # Loans
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS loans (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
+                id BLOB PRIMARY KEY CHECK (length(id) = 16),
+                user_id BLOB NOT NULL,
                 amount REAL NOT NULL,
                 interest_rate REAL DEFAULT 0.05,
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -105,65 +268,222 @@ class DatabaseManager:
             )
         ''')
         
+        if upgrading:
+            self._migrate_text_ids(conn)
+        
+        # Indexes for report and history lookups
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_user ON transactions (user_id, transaction_type)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tx_stock ON transactions (stock_id, transaction_type)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sph_stock_time ON stock_price_history (stock_id, timestamp DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_portfolio_user ON user_portfolios (user_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stocks_price ON stocks (current_price)")  # covers AVG(current_price)
+        
+        cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
         conn.commit()
-        conn.close()
+        
+        # Refresh planner statistics so the indexes are used; analysis_limit keeps this cheap on big tables
+        cursor.execute("PRAGMA analysis_limit=1000")
+        cursor.execute("ANALYZE")
+    
+    def _migrate_text_ids(self, conn):
+        """Copy rows out of the version 0 tables, converting UUID text keys to BLOBs"""
+        conn.create_function("uuid_blob", 1, uuid_to_blob, deterministic=True)
+        cursor = conn.cursor()
+        for table, uuid_columns in self.UUID_COLUMNS.items():
+            cursor.execute(f"PRAGMA table_info({table}_v0)")
+            columns = [row['name'] for row in cursor.fetchall()]
+            values = [f"uuid_blob({col})" if col in uuid_columns else col for col in columns]
+            cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                           f"SELECT {', '.join(values)} FROM {table}_v0")
+            cursor.execute(f"DROP TABLE {table}_v0")
+        logger.info("Migrated database keys to 16-byte UUIDs")
+    
+    def start_checkpoints(self):
+        """Start background thread that truncates the WAL off the request path"""
+        if self.checkpoint_thread is None or not self.checkpoint_thread.is_alive():
+            self.checkpoint_thread = threading.Thread(target=self._checkpoint_periodically)
+            self.checkpoint_thread.daemon = True
+            self.checkpoint_thread.start()
+    
+    def _checkpoint_periodically(self):
+        """Background function to checkpoint the WAL every few minutes"""
+        while True:
+            time.sleep(self.CHECKPOINT_INTERVAL)
+            try:
+                conn = self.get_connection()
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except Exception as e:
+                logger.error(f"Error checkpointing WAL: {str(e)}")
 
 class StockTradingSystem:
+    WRITE_BATCH_SIZE = 50  # most write jobs coalesced into one transaction
+    WRITE_TIMEOUT = 30  # seconds a caller waits for its write to start before giving up
+    # Seconds a stock snapshot is trusted; bounds price lag in processes that don't run the updater
+    STOCK_CACHE_TTL = 10
+    # Seconds read-mostly endpoint payloads are served from memory, per cache key ("name" or "name:arg")
+    RESPONSE_CACHE_TTLS = {"users_list": 2.0, "stocks_list": 2.0, "health": 5.0, "top_users": 30.0, "top_stocks": 30.0}
+    PRICE_HISTORY_LIMIT = 1000  # price points kept per stock
+    
     def __init__(self):
         self.db = DatabaseManager()
         self.price_update_thread = None
         self.stop_price_updates = False
+        self._price_update_wake = threading.Event()  # cuts the updater's sleep short on stop
+        self._price_updates_running = False  # set by the updater thread itself; read by health checks
+        # symbol -> {'id', 'price'}; prices only move on the periodic update
+        self._stocks_by_symbol = {}
+        self._stocks_loaded_at = 0.0
+        self._stock_lock = threading.Lock()
+        self._background_started = False
+        self._background_lock = threading.Lock()
+        self._leader_lock_file = None
+        self._response_cache = TLRUCache(
+            maxsize=64, ttu=lambda key, value, now: now + self.RESPONSE_CACHE_TTLS[key.partition(':')[0]]
+        )
+        self._response_cache_lock = threading.RLock()
+        self._price_rng = np.random.default_rng()  # only used from the writer thread
         self.setup_initial_data()
         
+        # All writes go through one thread per process so request threads never fight over the
+        # write lock; it starts on the first write, so a forking server's workers each get their own
+        self._write_q = queue.Queue()
+        self.writer_thread = None
+        self._writer_pid = None
+        self._writer_lock = threading.Lock()
+        
+        # Runs on interpreter exit, including gunicorn's graceful SIGTERM shutdown
+        atexit.register(self.stop_price_update_thread)
+        
     def setup_initial_data(self):
         """Initialize system with sample stocks and users"""
         conn = self.db.get_connection()
         cursor = conn.cursor()
         
-        # Check if data already exists
-        cursor.execute("SELECT COUNT(*) FROM stocks")
-        if cursor.fetchone()[0] == 0:
-            # Add sample stocks
-            sample_stocks = [
-                ('AAPL', 'Apple Inc.', 150.0, 1000),
-                ('GOOGL', 'Alphabet Inc.', 80.0, 800),
-                ('MSFT', 'Microsoft Corp.', 90.0, 900),
-                ('TSLA', 'Tesla Inc.', 75.0, 600),
-                ('AMZN', 'Amazon.com Inc.', 85.0, 700)
-            ]
-            
-            for symbol, name, price, quantity in sample_stocks:
-                stock_id = str(uuid.uuid4())
-                cursor.execute('''
-                    INSERT INTO stocks (id, symbol, name, current_price, available_quantity)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (stock_id, symbol, name, price, quantity))
-                
-                # Add initial price history
-                cursor.execute('''
-                    INSERT INTO stock_price_history (stock_id, price)
-                    VALUES (?, ?)
-                ''', (stock_id, price))
-        
-        # Check if test users exist
-        cursor.execute("SELECT COUNT(*) FROM users")
-        if cursor.fetchone()[0] == 0:
-            # Add test users
-            for i in range(10):
-                user_id = str(uuid.uuid4())
-                username = f"user_{i+1}"
-                cursor.execute('''
-                    INSERT INTO users (id, username, balance)
-                    VALUES (?, ?, ?)
-                ''', (user_id, username, 10000.0))
+        # Sample stocks; INSERT OR IGNORE makes seeding idempotent without counting rows
+        sample_stocks = [
+            ('AAPL', 'Apple Inc.', 150.0, 1000),
+            ('GOOGL', 'Alphabet Inc.', 80.0, 800),
+            ('MSFT', 'Microsoft Corp.', 90.0, 900),
+            ('TSLA', 'Tesla Inc.', 75.0, 600),
+            ('AMZN', 'Amazon.com Inc.', 85.0, 700)
+        ]
+        
+        # Deterministic ids, so a re-run maps onto the same rows
+        cursor.executemany('''
+            INSERT OR IGNORE INTO stocks (id, symbol, name, current_price, available_quantity)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(uuid.uuid5(uuid.NAMESPACE_DNS, f"stock.{symbol}").bytes, symbol, name, price, quantity)
+              for symbol, name, price, quantity in sample_stocks])
+        
+        # Add initial price history for sample stocks that have none yet
+        cursor.executemany('''
+            INSERT INTO stock_price_history (stock_id, price)
+            SELECT id, ? FROM stocks
+            WHERE symbol = ? AND NOT EXISTS (SELECT 1 FROM stock_price_history WHERE stock_id = stocks.id)
+        ''', [(price, symbol) for symbol, _, price, _ in sample_stocks])
+        
+        # Add test users
+        cursor.executemany('''
+            INSERT OR IGNORE INTO users (id, username, balance)
+            VALUES (?, ?, ?)
+        ''', [(uuid.uuid5(uuid.NAMESPACE_DNS, f"user.user_{i+1}").bytes, f"user_{i+1}", 10000.0)
+              for i in range(10)])
         
         conn.commit()
-        conn.close()
+        self._refresh_stock_cache(cursor)
+    
+    def _refresh_stock_cache(self, cursor):
+        """Reload the in-memory stock snapshot from the database"""
+        cursor.execute("SELECT id, symbol, current_price FROM stocks")
+        snapshot = {row['symbol']: {"id": row['id'], "price": row['current_price']} for row in cursor.fetchall()}
+        with self._stock_lock:
+            self._stocks_by_symbol = snapshot
+            self._stocks_loaded_at = time.monotonic()
+    
+    def _lookup_stock(self, symbol):
+        """Return (stock_id, price) for a symbol, or None if it does not exist"""
+        with self._stock_lock:
+            fresh = time.monotonic() - self._stocks_loaded_at <= self.STOCK_CACHE_TTL
+            stock = self._stocks_by_symbol.get(symbol)
+        if fresh and stock is not None:
+            return stock['id'], stock['price']
+        
+        # Only borrow a connection when the snapshot is stale or misses
+        with self.db.reader() as conn:
+            cursor = conn.cursor()
+            if not fresh:
+                self._refresh_stock_cache(cursor)
+                with self._stock_lock:
+                    stock = self._stocks_by_symbol.get(symbol)
+                if stock is not None:
+                    return stock['id'], stock['price']
+            
+            # Cache miss, e.g. a stock registered by another process
+            cursor.execute("SELECT id, current_price FROM stocks WHERE symbol = ?", (symbol,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        with self._stock_lock:
+            self._stocks_by_symbol[symbol] = {"id": row['id'], "price": row['current_price']}
+        return row['id'], row['current_price']
+    
+    def cache_get(self, key):
+        """Return the cached payload for key, or None if it is missing or expired"""
+        with self._response_cache_lock:
+            return self._response_cache.get(key)
+    
+    def cache_put(self, key, value):
+        """Store a payload under key for its configured TTL"""
+        with self._response_cache_lock:
+            self._response_cache[key] = value
+    
+    def cached(self, key, compute):
+        """Return the cached payload for key, computing and storing it on a miss"""
+        value = self.cache_get(key)
+        if value is None:
+            value = compute()
+            self.cache_put(key, value)
+        return value
+    
+    def invalidate(self, *keys):
+        """Drop cached payloads that a write has made stale"""
+        with self._response_cache_lock:
+            for key in keys:
+                self._response_cache.pop(key, None)
+    
+    def start_background_tasks(self):
+        """Start price updates and WAL checkpoints, in exactly one process"""
+        if self._background_started:
+            return
+        with self._background_lock:
+            if self._background_started:
+                return
+            self._background_started = True
+        
+        if not self._acquire_leader_lock():
+            logger.info("Background tasks are running in another process")
+            return
+        self.db.start_checkpoints()
+        self.start_price_updates()
+    
+    def _acquire_leader_lock(self):
+        """Take a non-blocking flock next to the database; held for the life of the process"""
+        if fcntl is None:
+            return True
+        lock_file = open(f"{self.db.db_path}-updater.lock", 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._leader_lock_file = lock_file
+        return True
     
     def start_price_updates(self):
         """Start background thread for price updates"""
         if self.price_update_thread is None or not self.price_update_thread.is_alive():
             self.stop_price_updates = False
+            self._price_update_wake.clear()
             self.price_update_thread = threading.Thread(target=self._update_prices_periodically)
             self.price_update_thread.daemon = True
             self.price_update_thread.start()
@@ -172,147 +492,283 @@ class StockTradingSystem:
     def stop_price_update_thread(self):
         """Stop the price update thread"""
         self.stop_price_updates = True
+        self._price_update_wake.set()
         if self.price_update_thread:
             self.price_update_thread.join()
     
     def _update_prices_periodically(self):
         """Background function to update stock prices every 5 minutes"""
-        while not self.stop_price_updates:
+        self._price_updates_running = True
+        try:
+            while not self.stop_price_updates:
+                try:
+                    self.update_stock_prices()
+                    logger.info("Updated stock prices")
+                    self._price_update_wake.wait(300)  # 5 minutes
+                except Exception as e:
+                    logger.error(f"Error updating prices: {str(e)}")
+                    self._price_update_wake.wait(60)  # Wait 1 minute before retrying
+        finally:
+            self._price_updates_running = False
+    
+    def _ensure_writer(self):
+        """Start this process's writer thread if it is not running"""
+        pid = os.getpid()
+        if self._writer_pid == pid and self.writer_thread.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer_pid == pid and self.writer_thread.is_alive():
+                return
+            if self._writer_pid != pid:
+                # Forked child: the parent's queue and whatever it held stay with the parent
+                self._write_q = queue.Queue()
+                self._writer_pid = pid
+            self.writer_thread = threading.Thread(target=self._writer_loop)
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+    
+    def _submit_write(self, func, *args):
+        """Queue a write job for the writer thread and wait for its committed result"""
+        self._ensure_writer()
+        future = Future()
+        self._write_q.put([(func, args, future)])
+        try:
+            return future.result(timeout=self.WRITE_TIMEOUT)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise TimeoutError("Timed out waiting for the database writer; the write was not applied")
+            # The writer already picked the job up, so its outcome is imminent
+            return future.result()
+    
+    def _submit_writes(self, jobs):
+        """Queue several (func, args) jobs to commit in the same transaction; returns a Future per job"""
+        self._ensure_writer()
+        group = [(func, args, Future()) for func, args in jobs]
+        self._write_q.put(group)
+        return [future for _, _, future in group]
+    
+    def _writer_loop(self):
+        """Apply queued write jobs on one connection, coalescing bursts into one transaction"""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        
+        while True:
+            # Queue entries are groups of jobs that must share a transaction
+            batch = list(self._write_q.get())
+            # Take whatever else is already waiting; never delay a lone job
+            while len(batch) < self.WRITE_BATCH_SIZE:
+                try:
+                    batch.extend(self._write_q.get_nowait())
+                except queue.Empty:
+                    break
+            # Skip jobs whose callers gave up waiting; the rest can no longer be cancelled
+            batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            
+            outcomes = []
             try:
-                self.update_stock_prices()
-                logger.info("Updated stock prices")
-                time.sleep(300)  # 5 minutes
+                cursor.execute("BEGIN IMMEDIATE")
+                for func, args, future in batch:
+                    # A savepoint per job keeps one failed trade from undoing its neighbours
+                    cursor.execute("SAVEPOINT job")
+                    try:
+                        result = func(cursor, *args)
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO job")
+                        outcomes.append((future, None, e))
+                    else:
+                        if isinstance(result, dict) and not result.get("success", True):
+                            cursor.execute("ROLLBACK TO job")
+                        outcomes.append((future, result, None))
+                    cursor.execute("RELEASE job")
+                conn.commit()
             except Exception as e:
-                logger.error(f"Error updating prices: {str(e)}")
-                time.sleep(60)  # Wait 1 minute before retrying
+                conn.rollback()
+                logger.error(f"Error committing write batch: {str(e)}")
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            for future, result, error in outcomes:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
     
     def update_stock_prices(self):
         """Update all stock prices randomly within 1-100 range"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
+        self._submit_write(self._apply_price_update)
+        with self.db.reader() as conn:
+            self._refresh_stock_cache(conn.cursor())
+        self.invalidate("stocks_list")
+    
+    def _apply_price_update(self, cursor):
+        """Writer job: move every price and record it in history"""
         cursor.execute("SELECT id, current_price FROM stocks")
         stocks = cursor.fetchall()
+        stock_ids = [stock[0] for stock in stocks]
+        prices = np.fromiter((stock[1] for stock in stocks), dtype=np.float64, count=len(stocks))
         
-        for stock in stocks:
-            stock_id, current_price = stock['id'], stock['current_price']
-            
-            # Generate new price with some volatility
-            change_percent = random.uniform(-0.1, 0.1)  # ±10% change
-            new_price = current_price * (1 + change_percent)
-            
-            # Ensure price stays between 1 and 100
-            new_price = max(1.0, min(100.0, new_price))
-            
-            # Update current price
-            cursor.execute('''
-                UPDATE stocks SET current_price = ? WHERE id = ?
-            ''', (new_price, stock_id))
-            
-            # Add to price history
-            cursor.execute('''
-                INSERT INTO stock_price_history (stock_id, price)
-                VALUES (?, ?)
-            ''', (stock_id, new_price))
+        # Generate new prices with ±10% volatility, kept between 1 and 100, updating the buffer in place
+        prices *= self._price_rng.uniform(0.9, 1.1, len(prices))
+        np.clip(prices, 1.0, 100.0, out=prices)
+        new_prices = prices.tolist()
         
-        conn.commit()
-        conn.close()
+        # Update current prices
+        cursor.executemany('''
+            UPDATE stocks SET current_price = ? WHERE id = ?
+        ''', zip(new_prices, stock_ids))
+        
+        # Add to price history
+        cursor.executemany('''
+            INSERT INTO stock_price_history (stock_id, price)
+            VALUES (?, ?)
+        ''', zip(stock_ids, new_prices))
+        
+        # Keep only the most recent points per stock so history aggregates stay bounded
+        cursor.executemany('''
+            DELETE FROM stock_price_history
+            WHERE stock_id = ? AND id < (
+                SELECT MIN(id) FROM (
+                    SELECT id FROM stock_price_history WHERE stock_id = ? ORDER BY id DESC LIMIT ?
+                )
+            )
+        ''', [(stock_id, stock_id, self.PRICE_HISTORY_LIMIT) for stock_id in stock_ids])
     
     def register_stock(self, symbol, name, price, quantity):
         """Register a new stock"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
+        stock_id = uuid.uuid4()
+        price = max(1.0, min(100.0, price))  # Ensure price is between 1-100
         
         try:
-            stock_id = str(uuid.uuid4())
-            price = max(1.0, min(100.0, price))  # Ensure price is between 1-100
-            
-            cursor.execute('''
-                INSERT INTO stocks (id, symbol, name, current_price, available_quantity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (stock_id, symbol.upper(), name, price, quantity))
-            
-            # Add initial price history
-            cursor.execute('''
-                INSERT INTO stock_price_history (stock_id, price)
-                VALUES (?, ?)
-            ''', (stock_id, price))
-            
-            conn.commit()
-            return {"success": True, "stock_id": stock_id, "message": "Stock registered successfully"}
+            self._submit_write(self._apply_register_stock, stock_id.bytes, symbol.upper(), name, price, quantity)
         except sqlite3.IntegrityError:
             return {"success": False, "message": "Stock symbol already exists"}
-        finally:
-            conn.close()
+        
+        with self._stock_lock:
+            self._stocks_by_symbol[symbol.upper()] = {"id": stock_id.bytes, "price": price}
+        self.invalidate("stocks_list")
+        return {"success": True, "stock_id": str(stock_id), "message": "Stock registered successfully"}
+    
+    def _apply_register_stock(self, cursor, stock_id, symbol, name, price, quantity):
+        """Writer job: insert a stock and its first price point"""
+        cursor.execute('''
+            INSERT INTO stocks (id, symbol, name, current_price, available_quantity)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (stock_id, symbol, name, price, quantity))
+        
+        # Add initial price history
+        cursor.execute('''
+            INSERT INTO stock_price_history (stock_id, price)
+            VALUES (?, ?)
+        ''', (stock_id, price))
     
     def get_stock_history(self, symbol=None):
         """Get stock price history"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        if symbol:
-            cursor.execute('''
-                SELECT s.symbol, s.name, sph.price, sph.timestamp
-                FROM stock_price_history sph
-                JOIN stocks s ON sph.stock_id = s.id
-                WHERE s.symbol = ?
-                ORDER BY sph.timestamp DESC
-                LIMIT 100
-            ''', (symbol.upper(),))
-        else:
-            cursor.execute('''
-                SELECT s.symbol, s.name, sph.price, sph.timestamp
-                FROM stock_price_history sph
-                JOIN stocks s ON sph.stock_id = s.id
-                ORDER BY sph.timestamp DESC
-                LIMIT 500
-            ''')
-        
-        history = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return history
+        with self.db.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None  # plain tuples; the response dicts are built directly
+            
+            if symbol:
+                cursor.execute('''
+                    SELECT s.symbol, s.name, sph.price, sph.timestamp
+                    FROM stock_price_history sph
+                    JOIN stocks s ON sph.stock_id = s.id
+                    WHERE sph.stock_id = (SELECT id FROM stocks WHERE symbol = ?)
+                    ORDER BY sph.timestamp DESC
+                    LIMIT 100
+                ''', (symbol.upper(),))
+            else:
+                cursor.execute('''
+                    SELECT s.symbol, s.name, sph.price, sph.timestamp
+                    FROM stock_price_history sph
+                    JOIN stocks s ON sph.stock_id = s.id
+                    ORDER BY sph.timestamp DESC
+                    LIMIT 500
+                ''')
+            
+            history = [{"symbol": row[0], "name": row[1], "price": row[2], "timestamp": row[3]}
+                       for row in cursor.fetchall()]
+            return history
     
     def take_loan(self, user_id, amount):
         """Allow user to take a loan"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
+        result = self._submit_write(self._apply_loan, uuid_to_blob(user_id), amount)
+        if result["success"]:
+            self.invalidate("users_list")
+        return result
+    
+    def submit_trades(self, user_id, trades):
+        """Queue a user's (action, symbol, quantity) trades to commit in order within one transaction.
         
+        Returns a Future per trade that resolves to its result dict once committed.
+        """
+        user_key = uuid_to_blob(user_id)
+        results = [Future() for _ in trades]
+        jobs = []
+        for i, (action, symbol, quantity) in enumerate(trades):
+            if action == 'loan':
+                jobs.append((i, self._apply_loan, (user_key, quantity)))
+                continue
+            
+            stock = self._lookup_stock(symbol.upper())
+            if not stock:
+                results[i].set_result({"success": False, "message": "Stock not found"})
+                continue
+            stock_id, price = stock
+            func = self._apply_buy if action == 'buy' else self._apply_sell
+            jobs.append((i, func, (user_key, symbol.upper(), stock_id, price, quantity)))
+        
+        # Each trade still gets its own savepoint, so one failure leaves the others intact
+        futures = self._submit_writes([(func, args) for _, func, args in jobs])
+        for (i, func, args), future in zip(jobs, futures):
+            future.add_done_callback(partial(self._settle_trade, results[i]))
+        return results
+    
+    def _settle_trade(self, result_future, write_future):
+        """Drop stale listings for a committed trade, then publish its result"""
+        try:
+            result = write_future.result()
+        except Exception as e:
+            result = {"success": False, "message": str(e)}
+        if result["success"]:
+            self.invalidate("users_list", "stocks_list")
+        result_future.set_result(result)
+    
+    def _apply_loan(self, cursor, user_id, amount):
+        """Writer job: grant a loan if it stays under the user's limit"""
         # Check user eligibility
         cursor.execute("SELECT balance, loan_amount, max_loan FROM users WHERE id = ?", (user_id,))
         user = cursor.fetchone()
         
         if not user:
-            conn.close()
             return {"success": False, "message": "User not found"}
         
         current_loan = user['loan_amount']
         max_loan = user['max_loan']
         
         if current_loan + amount > max_loan:
-            conn.close()
             return {"success": False, "message": f"Loan amount exceeds maximum limit of {max_loan}"}
         
         # Process loan
-        loan_id = str(uuid.uuid4())
+        loan_id = uuid.uuid4()
         new_balance = user['balance'] + amount
         new_loan_amount = current_loan + amount
         
         cursor.execute('''
             INSERT INTO loans (id, user_id, amount)
             VALUES (?, ?, ?)
-        ''', (loan_id, user_id, amount))
+        ''', (loan_id.bytes, user_id, amount))
         
         cursor.execute('''
             UPDATE users SET balance = ?, loan_amount = ?
             WHERE id = ?
         ''', (new_balance, new_loan_amount, user_id))
         
-        conn.commit()
-        conn.close()
-        
         return {
             "success": True,
-            "loan_id": loan_id,
+            "loan_id": str(loan_id),
             "amount": amount,
             "new_balance": new_balance,
             "total_loan": new_loan_amount
@@ -320,386 +776,400 @@ class StockTradingSystem:
     
     def buy_stock(self, user_id, symbol, quantity):
         """Buy stocks for a user"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
         try:
             # Get stock info
-            cursor.execute('''
-                SELECT id, current_price, available_quantity
-                FROM stocks WHERE symbol = ?
-            ''', (symbol.upper(),))
-            stock = cursor.fetchone()
+            stock = self._lookup_stock(symbol.upper())
             
             if not stock:
                 return {"success": False, "message": "Stock not found"}
             
-            stock_id, price, available = stock['id'], stock['current_price'], stock['available_quantity']
-            
-            if quantity > available:
-                return {"success": False, "message": "Insufficient stock availability"}
-            
-            # Get user info
-            cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
-            user = cursor.fetchone()
-            
-            if not user:
-                return {"success": False, "message": "User not found"}
-            
-            total_cost = price * quantity
-            
-            if user['balance'] < total_cost:
-                return {"success": False, "message": "Insufficient balance"}
-            
-            # Process transaction
-            transaction_id = str(uuid.uuid4())
-            new_balance = user['balance'] - total_cost
-            new_available = available - quantity
-            
-            # Update user balance
-            cursor.execute('''
-                UPDATE users SET balance = ? WHERE id = ?
-            ''', (new_balance, user_id))
-            
-            # Update stock availability
-            cursor.execute('''
-                UPDATE stocks SET available_quantity = ? WHERE id = ?
-            ''', (new_available, stock_id))
-            
-            # Update user portfolio
-            cursor.execute('''
-                SELECT quantity, avg_buy_price FROM user_portfolios
-                WHERE user_id = ? AND stock_id = ?
-            ''', (user_id, stock_id))
-            
-            portfolio = cursor.fetchone()
-            
-            if portfolio:
-                # Update existing position
-                old_qty, old_avg = portfolio['quantity'], portfolio['avg_buy_price']
-                new_qty = old_qty + quantity
-                new_avg = ((old_qty * old_avg) + (quantity * price)) / new_qty
-                
-                cursor.execute('''
-                    UPDATE user_portfolios SET quantity = ?, avg_buy_price = ?
-                    WHERE user_id = ? AND stock_id = ?
-                ''', (new_qty, new_avg, user_id, stock_id))
-            else:
-                # Create new position
-                cursor.execute('''
-                    INSERT INTO user_portfolios (user_id, stock_id, quantity, avg_buy_price)
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, stock_id, quantity, price))
-            
-            # Record transaction
-            cursor.execute('''
-                INSERT INTO transactions (id, user_id, stock_id, transaction_type, quantity, price, total_amount)
-                VALUES (?, ?, ?, 'BUY', ?, ?, ?)
-            ''', (transaction_id, user_id, stock_id, quantity, price, total_cost))
-            
-            conn.commit()
-            
-            return {
-                "success": True,
-                "transaction_id": transaction_id,
-                "symbol": symbol.upper(),
-                "quantity": quantity,
-                "price": price,
-                "total_cost": total_cost,
-                "new_balance": new_balance
-            }
-            
+            stock_id, price = stock
+            result = self._submit_write(self._apply_buy, uuid_to_blob(user_id), symbol.upper(), stock_id, price, quantity)
         except Exception as e:
-            conn.rollback()
             return {"success": False, "message": str(e)}
-        finally:
-            conn.close()
+        
+        if result["success"]:
+            self.invalidate("users_list", "stocks_list")
+        return result
+    
+    def _apply_buy(self, cursor, user_id, symbol, stock_id, price, quantity):
+        """Writer job: debit the user and move shares into their portfolio"""
+        total_cost = price * quantity
+        transaction_id = uuid.uuid4()
+        
+        # Reserve stock availability; the WHERE guards replace read-then-check
+        cursor.execute('''
+            UPDATE stocks SET available_quantity = available_quantity - ?
+            WHERE id = ? AND available_quantity >= ?
+        ''', (quantity, stock_id, quantity))
+        
+        if cursor.rowcount == 0:
+            return {"success": False, "message": "Insufficient stock availability"}
+        
+        # Debit user balance
+        cursor.execute('''
+            UPDATE users SET balance = balance - ?
+            WHERE id = ? AND balance >= ?
+            RETURNING balance
+        ''', (total_cost, user_id, total_cost))
+        user = cursor.fetchone()
+        
+        if not user:
+            # Only the failure path pays for telling the two cases apart
+            cursor.execute("SELECT 1 FROM users WHERE id = ?", (user_id,))
+            message = "Insufficient balance" if cursor.fetchone() else "User not found"
+            return {"success": False, "message": message}
+        
+        new_balance = float(user['balance'])  # RETURNING skips REAL affinity for whole numbers
+        
+        # Add to user portfolio, averaging the buy price into an existing position
+        cursor.execute('''
+            INSERT INTO user_portfolios (user_id, stock_id, quantity, avg_buy_price)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, stock_id) DO UPDATE SET
+                avg_buy_price = ((quantity * avg_buy_price) + (excluded.quantity * excluded.avg_buy_price))
+                                / (quantity + excluded.quantity),
+                quantity = quantity + excluded.quantity
+        ''', (user_id, stock_id, quantity, price))
+        
+        # Record transaction
+        cursor.execute('''
+            INSERT INTO transactions (id, user_id, stock_id, transaction_type, quantity, price, total_amount)
+            VALUES (?, ?, ?, 'BUY', ?, ?, ?)
+        ''', (transaction_id.bytes, user_id, stock_id, quantity, price, total_cost))
+        
+        return {
+            "success": True,
+            "transaction_id": str(transaction_id),
+            "symbol": symbol,
+            "quantity": quantity,
+            "price": price,
+            "total_cost": total_cost,
+            "new_balance": new_balance
+        }
     
     def sell_stock(self, user_id, symbol, quantity):
         """Sell stocks for a user"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
         try:
             # Get stock info
-            cursor.execute('''
-                SELECT id, current_price, available_quantity
-                FROM stocks WHERE symbol = ?
-            ''', (symbol.upper(),))
-            stock = cursor.fetchone()
+            stock = self._lookup_stock(symbol.upper())
             
             if not stock:
                 return {"success": False, "message": "Stock not found"}
             
-            stock_id, price, available = stock['id'], stock['current_price'], stock['available_quantity']
-            
-            # Check user portfolio
-            cursor.execute('''
-                SELECT quantity, avg_buy_price FROM user_portfolios
-                WHERE user_id = ? AND stock_id = ?
-            ''', (user_id, stock_id))
-            
-            portfolio = cursor.fetchone()
-            
-            if not portfolio or portfolio['quantity'] < quantity:
-                return {"success": False, "message": "Insufficient stocks to sell"}
-            
-            # Get user info
-            cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
-            user = cursor.fetchone()
-            
-            # Process transaction
-            transaction_id = str(uuid.uuid4())
-            total_earnings = price * quantity
-            new_balance = user['balance'] + total_earnings
-            new_portfolio_qty = portfolio['quantity'] - quantity
-            new_available = available + quantity
-            
-            # Update user balance
-            cursor.execute('''
-                UPDATE users SET balance = ? WHERE id = ?
-            ''', (new_balance, user_id))
-            
-            # Update stock availability
-            cursor.execute('''
-                UPDATE stocks SET available_quantity = ? WHERE id = ?
-            ''', (new_available, stock_id))
-            
-            # Update portfolio
-            if new_portfolio_qty == 0:
-                cursor.execute('''
-                    DELETE FROM user_portfolios WHERE user_id = ? AND stock_id = ?
-                ''', (user_id, stock_id))
-            else:
-                cursor.execute('''
-                    UPDATE user_portfolios SET quantity = ? WHERE user_id = ? AND stock_id = ?
-                ''', (new_portfolio_qty, user_id, stock_id))
-            
-            # Record transaction
-            cursor.execute('''
-                INSERT INTO transactions (id, user_id, stock_id, transaction_type, quantity, price, total_amount)
-                VALUES (?, ?, ?, 'SELL', ?, ?, ?)
-            ''', (transaction_id, user_id, stock_id, quantity, price, total_earnings))
-            
-            conn.commit()
-            
-            return {
-                "success": True,
-                "transaction_id": transaction_id,
-                "symbol": symbol.upper(),
-                "quantity": quantity,
-                "price": price,
-                "total_earnings": total_earnings,
-                "new_balance": new_balance
-            }
-            
+            stock_id, price = stock
+            result = self._submit_write(self._apply_sell, uuid_to_blob(user_id), symbol.upper(), stock_id, price, quantity)
         except Exception as e:
-            conn.rollback()
             return {"success": False, "message": str(e)}
-        finally:
-            conn.close()
+        
+        if result["success"]:
+            self.invalidate("users_list", "stocks_list")
+        return result
     
-    def get_user_report(self, user_id):
-        """Generate user performance report"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
+    def _apply_sell(self, cursor, user_id, symbol, stock_id, price, quantity):
+        """Writer job: credit the user and return shares to the market"""
+        total_earnings = price * quantity
+        transaction_id = uuid.uuid4()
         
-        # Get user basic info
+        # Reduce the position only if it holds enough shares
         cursor.execute('''
-            SELECT username, balance, loan_amount FROM users WHERE id = ?
-        ''', (user_id,))
-        user = cursor.fetchone()
+            UPDATE user_portfolios SET quantity = quantity - ?
+            WHERE user_id = ? AND stock_id = ? AND quantity >= ?
+        ''', (quantity, user_id, stock_id, quantity))
         
-        if not user:
-            conn.close()
-            return {"success": False, "message": "User not found"}
+        if cursor.rowcount == 0:
+            return {"success": False, "message": "Insufficient stocks to sell"}
         
-        # Get portfolio value
         cursor.execute('''
-            SELECT up.quantity, up.avg_buy_price, s.current_price, s.symbol
-            FROM user_portfolios up
-            JOIN stocks s ON up.stock_id = s.id
-            WHERE up.user_id = ?
-        ''', (user_id,))
-        
-        portfolio = cursor.fetchall()
-        portfolio_value = 0
-        unrealized_pnl = 0
-        
-        portfolio_details = []
-        for holding in portfolio:
-            qty = holding['quantity']
-            avg_price = holding['avg_buy_price']
-            current_price = holding['current_price']
-            symbol = holding['symbol']
-            
-            position_value = qty * current_price
-            position_pnl = qty * (current_price - avg_price)
-            
-            portfolio_value += position_value
-            unrealized_pnl += position_pnl
-            
-            portfolio_details.append({
-                "symbol": symbol,
-                "quantity": qty,
-                "avg_buy_price": avg_price,
-                "current_price": current_price,
-                "position_value": position_value,
-                "unrealized_pnl": position_pnl
-            })
-        
-        # Get realized PnL from transactions
+            DELETE FROM user_portfolios WHERE user_id = ? AND stock_id = ? AND quantity = 0
+        ''', (user_id, stock_id))
+        
+        # Credit user balance
         cursor.execute('''
-            SELECT 
-                SUM(CASE WHEN transaction_type = 'SELL' THEN total_amount ELSE 0 END) as total_sales,
-                SUM(CASE WHEN transaction_type = 'BUY' THEN total_amount ELSE 0 END) as total_purchases
-            FROM transactions WHERE user_id = ?
-        ''', (user_id,))
+            UPDATE users SET balance = balance + ? WHERE id = ?
+            RETURNING balance
+        ''', (total_earnings, user_id))
+        user = cursor.fetchone()
         
-        txn_summary = cursor.fetchone()
-        total_sales = txn_summary['total_sales'] or 0
-        total_purchases = txn_summary['total_purchases'] or 0
+        if not user:
+            return {"success": False, "message": "User not found"}
         
-        # Calculate net worth
-        initial_balance = 10000.0  # Starting balance
-        net_worth = user['balance'] + portfolio_value - user['loan_amount']
-        total_pnl = net_worth - initial_balance
+        new_balance = float(user['balance'])
         
-        conn.close()
+        # Update stock availability
+        cursor.execute('''
+            UPDATE stocks SET available_quantity = available_quantity + ? WHERE id = ?
+        ''', (quantity, stock_id))
+        
+        # Record transaction
+        cursor.execute('''
+            INSERT INTO transactions (id, user_id, stock_id, transaction_type, quantity, price, total_amount)
+            VALUES (?, ?, ?, 'SELL', ?, ?, ?)
+        ''', (transaction_id.bytes, user_id, stock_id, quantity, price, total_earnings))
         
         return {
             "success": True,
-            "user_info": {
-                "username": user['username'],
-                "balance": user['balance'],
-                "loan_amount": user['loan_amount'],
-                "portfolio_value": portfolio_value,
-                "net_worth": net_worth
-            },
-            "performance": {
-                "total_pnl": total_pnl,
-                "unrealized_pnl": unrealized_pnl,
-                "realized_pnl": total_sales - total_purchases,
-                "total_purchases": total_purchases,
-                "total_sales": total_sales
-            },
-            "portfolio": portfolio_details
+            "transaction_id": str(transaction_id),
+            "symbol": symbol,
+            "quantity": quantity,
+            "price": price,
+            "total_earnings": total_earnings,
+            "new_balance": new_balance
         }
     
+    def get_user_report(self, user_id):
+        """Generate user performance report"""
+        with self.db.reader() as conn:
+            cursor = conn.cursor()
+            user_key = uuid_to_blob(user_id)
+            
+            # User info, transaction totals and holdings in one round-trip: one row per
+            # holding, or a single row with NULL holding columns for an empty portfolio
+            cursor.execute('''
+                WITH txn AS (
+                    SELECT 
+                        COALESCE(SUM(CASE WHEN transaction_type = 'SELL' THEN total_amount END), 0) as total_sales,
+                        COALESCE(SUM(CASE WHEN transaction_type = 'BUY' THEN total_amount END), 0) as total_purchases
+                    FROM transactions WHERE user_id = ?
+                )
+                SELECT 
+                    u.username, u.balance, u.loan_amount,
+                    txn.total_sales, txn.total_purchases,
+                    up.quantity, up.avg_buy_price, s.current_price, s.symbol
+                FROM users u
+                CROSS JOIN txn
+                LEFT JOIN user_portfolios up ON up.user_id = u.id
+                LEFT JOIN stocks s ON up.stock_id = s.id
+                WHERE u.id = ?
+            ''', (user_key, user_key))
+            rows = cursor.fetchall()
+            
+            if not rows:
+                return {"success": False, "message": "User not found"}
+            
+            user = rows[0]
+            portfolio_value = 0
+            unrealized_pnl = 0
+            
+            portfolio_details = []
+            for holding in rows:
+                if holding['symbol'] is None:
+                    continue
+                qty = holding['quantity']
+                avg_price = holding['avg_buy_price']
+                current_price = holding['current_price']
+                symbol = holding['symbol']
+                
+                position_value = qty * current_price
+                position_pnl = qty * (current_price - avg_price)
+                
+                portfolio_value += position_value
+                unrealized_pnl += position_pnl
+                
+                portfolio_details.append({
+                    "symbol": symbol,
+                    "quantity": qty,
+                    "avg_buy_price": avg_price,
+                    "current_price": current_price,
+                    "position_value": position_value,
+                    "unrealized_pnl": position_pnl
+                })
+            
+            total_sales = user['total_sales']
+            total_purchases = user['total_purchases']
+            
+            # Calculate net worth
+            initial_balance = 10000.0  # Starting balance
+            net_worth = user['balance'] + portfolio_value - user['loan_amount']
+            total_pnl = net_worth - initial_balance
+            
+            return {
+                "success": True,
+                "user_info": {
+                    "username": user['username'],
+                    "balance": user['balance'],
+                    "loan_amount": user['loan_amount'],
+                    "portfolio_value": portfolio_value,
+                    "net_worth": net_worth
+                },
+                "performance": {
+                    "total_pnl": total_pnl,
+                    "unrealized_pnl": unrealized_pnl,
+                    "realized_pnl": total_sales - total_purchases,
+                    "total_purchases": total_purchases,
+                    "total_sales": total_sales
+                },
+                "portfolio": portfolio_details
+            }
+    
     def get_stock_report(self):
         """Generate stock performance report"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                s.symbol,
-                s.name,
-                s.current_price,
-                s.available_quantity,
-                COUNT(t.id) as transaction_count,
-                SUM(CASE WHEN t.transaction_type = 'BUY' THEN t.quantity ELSE 0 END) as total_bought,
-                SUM(CASE WHEN t.transaction_type = 'SELL' THEN t.quantity ELSE 0 END) as total_sold,
-                AVG(t.price) as avg_transaction_price,
-                MAX(sph.price) as max_price,
-                MIN(sph.price) as min_price
-            FROM stocks s
-            LEFT JOIN transactions t ON s.id = t.stock_id
-            LEFT JOIN stock_price_history sph ON s.id = sph.stock_id
-            GROUP BY s.id, s.symbol, s.name, s.current_price, s.available_quantity
-        ''')
-        
-        stocks = []
-        for row in cursor.fetchall():
-            stock_data = dict(row)
-            # Calculate price volatility
-            if stock_data['max_price'] and stock_data['min_price']:
-                volatility = ((stock_data['max_price'] - stock_data['min_price']) / stock_data['min_price']) * 100
-            else:
-                volatility = 0
+        with self.db.reader() as conn:
+            cursor = conn.cursor()
             
-            stock_data['volatility_percent'] = volatility
-            stocks.append(stock_data)
-        
-        conn.close()
-        return {"success": True, "stocks": stocks}
+            # Aggregate each child table on its own so they don't multiply each other's rows
+            cursor.execute('''
+                WITH tx AS (
+                    SELECT 
+                        stock_id,
+                        COUNT(*) as transaction_count,
+                        SUM(CASE WHEN transaction_type = 'BUY' THEN quantity ELSE 0 END) as total_bought,
+                        SUM(CASE WHEN transaction_type = 'SELL' THEN quantity ELSE 0 END) as total_sold,
+                        AVG(price) as avg_transaction_price
+                    FROM transactions
+                    GROUP BY stock_id
+                ),
+                sp AS (
+                    SELECT stock_id, MAX(price) as max_price, MIN(price) as min_price
+                    FROM stock_price_history
+                    GROUP BY stock_id
+                )
+                SELECT 
+                    s.symbol,
+                    s.name,
+                    s.current_price,
+                    s.available_quantity,
+                    COALESCE(tx.transaction_count, 0) as transaction_count,
+                    COALESCE(tx.total_bought, 0) as total_bought,
+                    COALESCE(tx.total_sold, 0) as total_sold,
+                    tx.avg_transaction_price,
+                    sp.max_price,
+                    sp.min_price
+                FROM stocks s
+                LEFT JOIN tx ON tx.stock_id = s.id
+                LEFT JOIN sp ON sp.stock_id = s.id
+            ''')
+            
+            stocks = []
+            for stock_data in cursor.fetchall():
+                # Calculate price volatility
+                if stock_data['max_price'] and stock_data['min_price']:
+                    volatility = ((stock_data['max_price'] - stock_data['min_price']) / stock_data['min_price']) * 100
+                else:
+                    volatility = 0
+                
+                stock_data['volatility_percent'] = volatility
+                stocks.append(stock_data)
+            
+            return {"success": True, "stocks": stocks}
     
     def get_top_users(self, limit=10):
         """Get top performing users"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        # Get all users with their portfolio values
-        cursor.execute('''
-            SELECT 
-                u.id,
-                u.username,
-                u.balance,
-                u.loan_amount,
-                COALESCE(SUM(up.quantity * s.current_price), 0) as portfolio_value
-            FROM users u
-            LEFT JOIN user_portfolios up ON u.id = up.user_id
-            LEFT JOIN stocks s ON up.stock_id = s.id
-            GROUP BY u.id, u.username, u.balance, u.loan_amount
-        ''')
-        
-        users = []
-        for row in cursor.fetchall():
-            user = dict(row)
-            net_worth = user['balance'] + user['portfolio_value'] - user['loan_amount']
-            total_pnl = net_worth - 10000.0  # Initial balance
+        with self.db.reader() as conn:
+            cursor = conn.cursor()
             
-            users.append({
-                "username": user['username'],
-                "balance": user['balance'],
-                "portfolio_value": user['portfolio_value'],
-                "loan_amount": user['loan_amount'],
-                "net_worth": net_worth,
-                "total_pnl": total_pnl
-            })
-        
-        # Sort by total PnL
-        users.sort(key=lambda x: x['total_pnl'], reverse=True)
-        
-        conn.close()
-        return {"success": True, "top_users": users[:limit]}
+            # Rank users by PnL against the 10000.0 initial balance
+            cursor.execute('''
+                SELECT 
+                    u.username,
+                    u.balance,
+                    COALESCE(SUM(up.quantity * s.current_price), 0) as portfolio_value,
+                    u.loan_amount,
+                    u.balance + COALESCE(SUM(up.quantity * s.current_price), 0) - u.loan_amount as net_worth,
+                    u.balance + COALESCE(SUM(up.quantity * s.current_price), 0) - u.loan_amount - 10000.0 as total_pnl
+                FROM users u
+                LEFT JOIN user_portfolios up ON u.id = up.user_id
+                LEFT JOIN stocks s ON up.stock_id = s.id
+                GROUP BY u.id
+                ORDER BY total_pnl DESC
+                LIMIT ?
+            ''', (limit,))
+            
+            return {"success": True, "top_users": cursor.fetchall()}
     
     def get_top_stocks(self, limit=10):
         """Get top performing stocks"""
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                s.symbol,
-                s.name,
-                s.current_price,
-                COUNT(t.id) as transaction_count,
-                SUM(CASE WHEN t.transaction_type = 'BUY' THEN t.quantity ELSE 0 END) as total_volume,
-                AVG(sph.price) as avg_price
-            FROM stocks s
-            LEFT JOIN transactions t ON s.id = t.stock_id
-            LEFT JOIN stock_price_history sph ON s.id = sph.stock_id
-            GROUP BY s.id, s.symbol, s.name, s.current_price
-            HAVING COUNT(sph.id) > 1
-        ''')
-        
-        stocks = []
-        for row in cursor.fetchall():
-            stock = dict(row)
-            if stock['avg_price']:
-                price_performance = ((stock['current_price'] - stock['avg_price']) / stock['avg_price']) * 100
-            else:
-                price_performance = 0
+        with self.db.reader() as conn:
+            cursor = conn.cursor()
             
-            stock['price_performance_percent'] = price_performance
-            stocks.append(stock)
-        
-        # Sort by transaction volume and performance
-        stocks.sort(key=lambda x: (x['total_volume'] or 0, x['price_performance_percent']), reverse=True)
-        
-        conn.close()
-        return {"success": True, "top_stocks": stocks[:limit]}
+            # Rank by transaction volume, then by price performance against the average
+            cursor.execute('''
+                WITH tx AS (
+                    SELECT 
+                        stock_id,
+                        COUNT(*) as transaction_count,
+                        SUM(CASE WHEN transaction_type = 'BUY' THEN quantity ELSE 0 END) as total_volume
+                    FROM transactions
+                    GROUP BY stock_id
+                ),
+                sp AS (
+                    SELECT stock_id, AVG(price) as avg_price
+                    FROM stock_price_history
+                    GROUP BY stock_id
+                    HAVING COUNT(*) > 1
+                )
+                SELECT 
+                    s.symbol,
+                    s.name,
+                    s.current_price,
+                    COALESCE(tx.transaction_count, 0) as transaction_count,
+                    COALESCE(tx.total_volume, 0) as total_volume,
+                    sp.avg_price,
+                    CASE WHEN sp.avg_price > 0 THEN (s.current_price - sp.avg_price) / sp.avg_price * 100
+                         ELSE 0 END as price_performance_percent
+                FROM stocks s
+                JOIN sp ON sp.stock_id = s.id
+                LEFT JOIN tx ON tx.stock_id = s.id
+                ORDER BY total_volume DESC, price_performance_percent DESC
+                LIMIT ?
+            ''', (limit,))
+            
+            return {"success": True, "top_stocks": cursor.fetchall()}
+    
+    def get_summary(self, top_n=5):
+        """Get the top users and top stocks together in a single query"""
+        with self.db.reader() as conn:
+            cursor = conn.cursor()
+            
+            # Same rankings as get_top_users/get_top_stocks, tagged by kind and stacked with UNION ALL
+            cursor.execute('''
+                WITH tx AS (
+                    SELECT stock_id, SUM(CASE WHEN transaction_type = 'BUY' THEN quantity ELSE 0 END) as total_volume
+                    FROM transactions
+                    GROUP BY stock_id
+                ),
+                sp AS (
+                    SELECT stock_id, AVG(price) as avg_price
+                    FROM stock_price_history
+                    GROUP BY stock_id
+                    HAVING COUNT(*) > 1
+                )
+                SELECT * FROM (
+                    SELECT 
+                        'user' as kind,
+                        u.username as label,
+                        u.balance + COALESCE(SUM(up.quantity * s.current_price), 0) - u.loan_amount as v1,
+                        u.balance + COALESCE(SUM(up.quantity * s.current_price), 0) - u.loan_amount - 10000.0 as v2
+                    FROM users u
+                    LEFT JOIN user_portfolios up ON u.id = up.user_id
+                    LEFT JOIN stocks s ON up.stock_id = s.id
+                    GROUP BY u.id
+                    ORDER BY v2 DESC
+                    LIMIT :n
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT 
+                        'stock' as kind,
+                        s.symbol as label,
+                        s.current_price as v1,
+                        COALESCE(tx.total_volume, 0) as v2
+                    FROM stocks s
+                    JOIN sp ON sp.stock_id = s.id
+                    LEFT JOIN tx ON tx.stock_id = s.id
+                    ORDER BY v2 DESC, CASE WHEN sp.avg_price > 0 THEN (s.current_price - sp.avg_price) / sp.avg_price ELSE 0 END DESC
+                    LIMIT :n
+                )
+            ''', {"n": top_n})
+            
+            top_users = []
+            top_stocks = []
+            for row in cursor.fetchall():
+                if row['kind'] == 'user':
+                    top_users.append({"username": row['label'], "net_worth": row['v1'], "total_pnl": row['v2']})
+                else:
+                    top_stocks.append({"symbol": row['label'], "current_price": row['v1'], "total_volume": row['v2']})
+            return {"success": True, "top_users": top_users, "top_stocks": top_stocks}
 
 # Flask application setup
 app = Flask(__name__)
@@ -707,9 +1177,20 @@ api = Api(app, version='1.0', title='Stock Trading Simulation API',
           description='A comprehensive stock trading simulation system with real-time updates',
           doc='/')
 
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    """Encode API responses with orjson instead of the stdlib encoder"""
+    resp = make_response(orjson.dumps(data), code)
+    resp.headers.extend(headers or {})
+    return resp
+
 # Initialize trading system
 trading_system = StockTradingSystem()
-trading_system.start_price_updates()
+
+@app.before_request
+def start_background_tasks():
+    """Start background tasks lazily, in the first process that serves a request"""
+    trading_system.start_background_tasks()
 
 # API Models for Swagger documentation
 stock_ns = Namespace('stocks', description='Stock management operations')
@@ -774,7 +1255,7 @@ class TopStocks(Resource):
     def get(self):
         """List top-performing stocks"""
         limit = request.args.get('limit', 10, type=int)
-        return trading_system.get_top_stocks(limit)
+        return trading_system.cached(f"top_stocks:{limit}", lambda: trading_system.get_top_stocks(limit))
 
 # User Management APIs
 @user_ns.route('/loan')
@@ -813,101 +1294,150 @@ class TopUsers(Resource):
     def get(self):
         """List top-performing users"""
         limit = request.args.get('limit', 10, type=int)
-        return trading_system.get_top_users(limit)
+        return trading_system.cached(f"top_users:{limit}", lambda: trading_system.get_top_users(limit))
 
 # Utility endpoints
+def stream_json_list(cache_key, field, table, columns, transform=None, batch_size=200):
+    """Respond with {field: [rows of table]}, streamed batch by batch on a cache miss"""
+    body = trading_system.cache_get(cache_key)
+    if body is not None:
+        return Response(body, mimetype='application/json')
+    
+    # Keyset pagination: each batch borrows a pooled connection only for its own query, so a
+    # slow client never holds a connection (and its read transaction) while we wait on the socket
+    sql = f"SELECT rowid, {columns} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?"
+    
+    def generate():
+        # Rows are encoded batch by batch as they are fetched; the finished body is cached
+        chunks = [b'{"' + field.encode() + b'":[']
+        yield chunks[0]
+        last_rowid = 0
+        while True:
+            with trading_system.db.reader() as conn:
+                rows = conn.execute(sql, (last_rowid, batch_size)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                last_rowid = row.pop('rowid')
+                if transform:
+                    transform(row)
+            chunk = orjson.dumps(rows)[1:-1]
+            if len(chunks) > 1:
+                chunk = b',' + chunk
+            chunks.append(chunk)
+            yield chunk
+            if len(rows) < batch_size:
+                break
+        chunks.append(b']}')
+        yield chunks[-1]
+        trading_system.cache_put(cache_key, b''.join(chunks))
+    
+    return Response(generate(), mimetype='application/json')
+
 @api.route('/users/list')
 class UsersList(Resource):
     def get(self):
         """Get list of all users (for testing)"""
-        conn = trading_system.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, username, balance, loan_amount FROM users")
-        users = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return {"users": users}
+        def convert_id(user):
+            user['id'] = blob_to_uuid(user['id'])
+        
+        return stream_json_list("users_list", "users", "users", "id, username, balance, loan_amount", convert_id)
 
 @api.route('/stocks/list')
 class StocksList(Resource):
     def get(self):
         """Get list of all stocks (for testing)"""
-        conn = trading_system.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT symbol, name, current_price, available_quantity FROM stocks")
-        stocks = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        return {"stocks": stocks}
+        return stream_json_list("stocks_list", "stocks", "stocks", "symbol, name, current_price, available_quantity")
 
 # Test function to simulate multiple users trading simultaneously
-def simulate_trading_session():
+async def simulate_trading_session():
     """
     Test function to simulate 5-10 users trading simultaneously
     """
-    print("Starting trading simulation...")
+    logger.info(f"Starting trading simulation ({'free-threaded' if FREE_THREADED else 'GIL'} build)...")
     
     # Get all users and stocks
-    conn = trading_system.db.get_connection()
-    cursor = conn.cursor()
+    def load_participants():
+        with trading_system.db.reader() as conn:
+            users = [{"id": blob_to_uuid(row['id']), "username": row['username']}
+                     for row in conn.execute("SELECT id, username FROM users LIMIT 10")]
+            stocks = [row['symbol'] for row in conn.execute("SELECT symbol FROM stocks")]
+        return users, stocks
     
-    cursor.execute("SELECT id, username FROM users LIMIT 10")
-    users = [dict(row) for row in cursor.fetchall()]
+    # SQLite calls block (including waiting for a pooled connection), so they run off the event loop
+    users, stocks = await asyncio.to_thread(load_participants)
     
-    cursor.execute("SELECT symbol FROM stocks")
-    stocks = [row['symbol'] for row in cursor.fetchall()]
-    
-    conn.close()
-    
-    def simulate_user_trading(user):
+    # Users pick from this list and trades price themselves from the stock snapshot,
+    # so no per-trade queries are needed while the snapshot is fresh
+    async def simulate_user_trading(user, stocks):
         """Simulate trading for a single user"""
         user_id = user['id']
         username = user['username']
         
-        print(f"Starting simulation for {username}")
+        logger.info(f"Starting simulation for {username}")
         
-        # Simulate random trading actions
-        for _ in range(random.randint(3, 8)):  # 3-8 trades per user
-            action = random.choice(['buy', 'sell', 'loan'])
-            
+        # Plan random trading actions up front, then commit them all in one transaction
+        rng = random.Random()  # own generator, seeded from os.urandom, instead of the shared module state
+        n = rng.randint(3, 8)  # 3-8 trades per user
+        actions = rng.choices(['buy', 'sell', 'loan'], k=n)
+        symbols = rng.choices(stocks, k=n)
+        quantities = rng.choices(range(1, 11), k=n)
+        amounts = rng.choices(range(1000, 5001), k=n)
+        
+        trades = []
+        for action, symbol, quantity, amount in zip(actions, symbols, quantities, amounts):
             if action == 'buy':
-                symbol = random.choice(stocks)
-                quantity = random.randint(1, 10)
-                result = trading_system.buy_stock(user_id, symbol, quantity)
-                print(f"{username} BUY {quantity} {symbol}: {result.get('message', 'Success' if result.get('success') else 'Failed')}")
-                
+                trades.append(('buy', symbol, quantity))
             elif action == 'sell':
-                symbol = random.choice(stocks)
-                quantity = random.randint(1, 5)
-                result = trading_system.sell_stock(user_id, symbol, quantity)
-                print(f"{username} SELL {quantity} {symbol}: {result.get('message', 'Success' if result.get('success') else 'Failed')}")
-                
+                trades.append(('sell', symbol, (quantity + 1) // 2))  # 1-5 shares
             elif action == 'loan':
-                amount = random.randint(1000, 5000)
-                result = trading_system.take_loan(user_id, amount)
-                print(f"{username} LOAN ${amount}: {result.get('message', 'Success' if result.get('success') else 'Failed')}")
-            
-            time.sleep(random.uniform(0.1, 0.5))  # Small delay between actions
-    
-    # Use ThreadPoolExecutor to simulate concurrent trading
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(simulate_user_trading, user) for user in users[:random.randint(5, 10)]]
+                trades.append(('loan', None, amount))
         
-        # Wait for all trading to complete
-        for future in futures:
-            future.result()
+        # Stock lookups may hit the database; the writer thread does the rest and we await its Futures
+        futures = await asyncio.to_thread(trading_system.submit_trades, user_id, trades)
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        for (action, symbol, quantity), result in zip(trades, results):
+            outcome = result.get('message', 'Success' if result.get('success') else 'Failed')
+            if action == 'loan':
+                logger.info(f"{username} LOAN ${quantity}: {outcome}")
+            else:
+                logger.info(f"{username} {action.upper()} {quantity} {symbol}: {outcome}")
     
-    print("Trading simulation completed!")
+    # One coroutine per user instead of a thread each; all of them wait on the writer thread
+    await asyncio.gather(*(simulate_user_trading(user, stocks) for user in users[:random.randint(5, 10)]))
     
-    # Generate summary report
-    print("\n=== SIMULATION SUMMARY ===")
-    top_users = trading_system.get_top_users(5)
-    print("Top 5 Users:")
-    for i, user in enumerate(top_users['top_users'], 1):
-        print(f"{i}. {user['username']}: Net Worth ${user['net_worth']:.2f}, PnL ${user['total_pnl']:.2f}")
+    logger.info("Trading simulation completed!")
     
-    top_stocks = trading_system.get_top_stocks(5)
-    print("\nTop 5 Stocks:")
-    for i, stock in enumerate(top_stocks['top_stocks'], 1):
-        print(f"{i}. {stock['symbol']}: Price ${stock['current_price']:.2f}, Volume {stock['total_volume'] or 0}")
+    # Generate summary report, emitted as one log record so it is never interleaved
+    summary = await asyncio.to_thread(trading_system.get_summary, 5)
+    lines = ["", "=== SIMULATION SUMMARY ===", "Top 5 Users:"]
+    lines += [f"{i}. {user['username']}: Net Worth ${user['net_worth']:.2f}, PnL ${user['total_pnl']:.2f}"
+              for i, user in enumerate(summary['top_users'], 1)]
+    lines += ["", "Top 5 Stocks:"]
+    lines += [f"{i}. {stock['symbol']}: Price ${stock['current_price']:.2f}, Volume {stock['total_volume'] or 0}"
+              for i, stock in enumerate(summary['top_stocks'], 1)]
+    logger.info("\n".join(lines))
+
+# At most this many simulations run at once; extra requests get a 429
+MAX_CONCURRENT_SIMULATIONS = 2
+_sim_slots = threading.BoundedSemaphore(MAX_CONCURRENT_SIMULATIONS)
+_sim_loop = None
+_sim_loop_lock = threading.Lock()
+
+def get_simulation_loop():
+    """Return the event loop simulations run on, starting its thread on first use"""
+    global _sim_loop
+    with _sim_loop_lock:
+        if _sim_loop is None:
+            _sim_loop = asyncio.new_event_loop()
+            threading.Thread(target=_sim_loop.run_forever, name="sim-loop", daemon=True).start()
+        return _sim_loop
+
+def _simulation_done(future):
+    """Free the simulation's slot and report any error it raised"""
+    _sim_slots.release()
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Trading simulation failed", exc_info=future.exception())
 
 # Background task management
 @api.route('/system/start-updates')
@@ -928,12 +1458,15 @@ class StopUpdates(Resource):
 class SimulateTrading(Resource):
     def post(self):
         """Run trading simulation with 5-10 users"""
+        if not _sim_slots.acquire(blocking=False):
+            return {"success": False, "message": "Too many simulations running, try again later"}, 429
         try:
-            # Run simulation in a separate thread to avoid blocking
-            simulation_thread = threading.Thread(target=simulate_trading_session)
-            simulation_thread.start()
+            # Run simulation on the background event loop to avoid blocking
+            future = asyncio.run_coroutine_threadsafe(simulate_trading_session(), get_simulation_loop())
+            future.add_done_callback(_simulation_done)
             return {"success": True, "message": "Trading simulation started"}
         except Exception as e:
+            _sim_slots.release()
             return {"success": False, "message": str(e)}
 
 @api.route('/system/force-price-update')
@@ -951,41 +1484,31 @@ class ForcePriceUpdate(Resource):
 class HealthCheck(Resource):
     def get(self):
         """System health check"""
-        conn = trading_system.db.get_connection()
-        cursor = conn.cursor()
-        
-        # Check database connectivity and get basic stats
-        cursor.execute("SELECT COUNT(*) FROM users")
-        user_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM stocks")
-        stock_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM transactions")
-        transaction_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT AVG(current_price) FROM stocks")
-        avg_stock_price = cursor.fetchone()[0]
-        
-        conn.close()
+        def load():
+            with trading_system.db.reader() as conn:
+                # Check database connectivity and get basic stats in one round trip
+                stats = conn.execute('''
+                    SELECT (SELECT COUNT(*) FROM users) as users,
+                           (SELECT COUNT(*) FROM stocks) as stocks,
+                           (SELECT COUNT(*) FROM transactions) as transactions,
+                           (SELECT AVG(current_price) FROM stocks) as avg_stock_price
+                ''').fetchone()
+            
+            stats['avg_stock_price'] = round(stats['avg_stock_price'] or 0, 2)
+            return stats
         
         return {
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
-            "stats": {
-                "users": user_count,
-                "stocks": stock_count,
-                "transactions": transaction_count,
-                "avg_stock_price": round(avg_stock_price or 0, 2)
-            },
-            "price_updates_active": trading_system.price_update_thread and trading_system.price_update_thread.is_alive()
+            "stats": trading_system.cached("health", load),
+            "price_updates_active": trading_system._price_updates_running
         }
 
 if __name__ == '__main__':
     try:
         print("🚀 Starting Stock Trading Simulation System...")
         print("📊 Database initialized with sample data")
-        print("💹 Background price updates started (every 5 minutes)")
+        print("💹 Background price updates start with the first request (every 5 minutes)")
         print("🌐 API Documentation available at: http://localhost:5000/")
         print("❤️  Health check available at: http://localhost:5000/health")
         print("\n📋 Available API Endpoints:")
@@ -1001,9 +1524,11 @@ if __name__ == '__main__':
         print("   POST /system/simulate-trading - Run trading simulation")
         print("\n🧪 To run trading simulation:")
         print("   curl -X POST http://localhost:5000/system/simulate-trading")
-        print("\n🔥 Starting Flask server...")
+        print("\n🔥 Starting Flask development server (use gunicorn with wsgi:application in production)...")
         
-        app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
+        # Turn SIGTERM into a normal exit so the atexit shutdown hooks run
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        app.run(host='0.0.0.0', port=5000, threaded=True)
     except KeyboardInterrupt:
         print("\n🛑 Shutting down...")
         trading_system.stop_price_update_thread()
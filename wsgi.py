@@ -0,0 +1,4 @@
+"""WSGI entry point: gunicorn -k gthread -w 1 --threads 16 wsgi:application"""
+from trading_system import app
+
+application = app